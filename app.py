@@ -2,164 +2,185 @@ import streamlit as st
 import pandas as pd
 from docx import Document
 import re
-from fuzzywuzzy import process, fuzz
+import ahocorasick
+from rapidfuzz import process, fuzz
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 import zipfile
 import os
 import tempfile
 
+PLACEHOLDER_RE = re.compile(r'\{\{(.+?)\}\}')
+STRAY_BRACE_RE = re.compile(r'[{}]')
+
 # Sanitize filenames
+_SANITIZE_RE = re.compile(r'[^\w\-_.]')
+
 def sanitize_filename(name):
-    return re.sub(r'[^\w\-_\.]', '_', str(name))
+    return _SANITIZE_RE.sub('_', str(name))
 
 # Normalize text for matching
+_NON_ALNUM_RE = re.compile(r'[\W_]+')
+
+@lru_cache(maxsize=None)
 def normalize_text(text):
-    return ''.join(char for char in text if char.isalnum()).lower()
+    return _NON_ALNUM_RE.sub('', text).lower()
 
-# Extract placeholders from the Word document
-def extract_placeholders(doc):
-    placeholders = set()
-    pattern = re.compile(r'\{\{(.+?)\}\}')
-    def get_full_text(runs):
-        return ''.join(run.text for run in runs)
-    for paragraph in doc.paragraphs:
-        full_text = get_full_text(paragraph.runs)
-        matches = pattern.findall(full_text)
-        placeholders.update(matches)
+# Yield every paragraph in the document body, tables, headers and footers
+def iter_all_paragraphs(doc):
+    yield from doc.paragraphs
     for table in doc.tables:
         for row in table.rows:
             for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    full_text = get_full_text(paragraph.runs)
-                    matches = pattern.findall(full_text)
-                    placeholders.update(matches)
+                yield from cell.paragraphs
     for section in doc.sections:
-        for header in section.header.paragraphs:
-            full_text = get_full_text(header.runs)
-            matches = pattern.findall(full_text)
-            placeholders.update(matches)
-        for footer in section.footer.paragraphs:
-            full_text = get_full_text(footer.runs)
-            matches = pattern.findall(full_text)
-            placeholders.update(matches)
+        yield from section.header.paragraphs
+        yield from section.footer.paragraphs
+
+# Extract placeholders from the Word document
+def extract_placeholders(doc):
+    placeholders = set()
+    for paragraph in iter_all_paragraphs(doc):
+        full_text = ''.join(run.text for run in paragraph.runs)
+        if '{{' not in full_text:
+            continue
+        placeholders.update(PLACEHOLDER_RE.findall(full_text))
     return placeholders
 
 # Find strings with { or } that are not placeholders
 def find_invalid_braces(doc):
     invalid_strings = set()
-    pattern = re.compile(r'(?<!\{)\{[^}]*\}|[^{]*\}[^{]*')
-    def check_text(text):
-        matches = pattern.findall(text)
-        if matches:
-            invalid_strings.update(matches)
-    for paragraph in doc.paragraphs:
-        check_text(''.join(run.text for run in paragraph.runs))
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    check_text(''.join(run.text for run in paragraph.runs))
-    for section in doc.sections:
-        for header in section.header.paragraphs:
-            check_text(''.join(run.text for run in header.runs))
-        for footer in section.footer.paragraphs:
-            check_text(''.join(run.text for run in footer.runs))
+    for paragraph in iter_all_paragraphs(doc):
+        full_text = ''.join(run.text for run in paragraph.runs)
+        if '{' not in full_text and '}' not in full_text:
+            continue
+        stripped = PLACEHOLDER_RE.sub('', full_text)
+        for match in STRAY_BRACE_RE.finditer(stripped):
+            start = max(match.start() - 10, 0)
+            invalid_strings.add(stripped[start:match.end() + 10])
     return invalid_strings
 
 # Fuzzy match placeholders to Excel columns
 def fuzzy_match_placeholders(placeholders, columns, threshold=85):
+    placeholders = list(placeholders)
+    if not placeholders or not columns:
+        return {placeholder: (None, 0) for placeholder in placeholders}
+    norm_placeholders = [normalize_text(placeholder) for placeholder in placeholders]
+    norm_columns = [normalize_text(col) for col in columns]
+    scores = process.cdist(
+        norm_placeholders,
+        norm_columns,
+        scorer=fuzz.token_sort_ratio,
+        score_cutoff=threshold,
+        workers=-1
+    )
     mapping = {}
-    for placeholder in placeholders:
-        norm_placeholder = normalize_text(placeholder)
-        norm_columns = {col: normalize_text(col) for col in columns}
-        best_match, score = process.extractOne(
-            norm_placeholder, 
-            list(norm_columns.values()), 
-            scorer=fuzz.token_sort_ratio
-        )
+    for i, placeholder in enumerate(placeholders):
+        j = scores[i].argmax()
+        score = int(round(float(scores[i, j])))
         if score >= threshold:
-            for col, norm_col in norm_columns.items():
-                if norm_col == best_match:
-                    mapping[placeholder] = (col, score)
-                    break
+            mapping[placeholder] = (columns[j], score)
         else:
             mapping[placeholder] = (None, 0)
     return mapping
 
+# Merge split runs so each placeholder survives as a single run
+def normalize_template_runs(doc):
+    for paragraph in iter_all_paragraphs(doc):
+        runs = paragraph.runs
+        if len(runs) < 2:
+            continue
+        full_text = ''.join(run.text for run in runs)
+        if '{{' not in full_text:
+            continue
+        runs[0].text = full_text
+        for run in runs[1:]:
+            run.text = ''
+
 # Replace text in a paragraph
 def replace_text_in_paragraph(paragraph, old_text, new_text):
     full_text = ''.join(run.text for run in paragraph.runs)
     if old_text not in full_text:
-        return
-    start_pos = full_text.find(old_text)
-    end_pos = start_pos + len(old_text)
-    current_pos = 0
-    for run in paragraph.runs:
-        run_start = current_pos
-        run_end = run_start + len(run.text)
-        if run_start < end_pos and run_end > start_pos:
-            overlap_start = max(run_start, start_pos)
-            overlap_end = min(run_end, end_pos)
-            keep_before = run.text[:overlap_start - run_start] if overlap_start > run_start else ''
-            keep_after = run.text[overlap_end - run_start:] if overlap_end < run_end else ''
-            if run_start <= start_pos < run_end:
-                run.text = keep_before + new_text + keep_after
-            else:
-                run.text = keep_before + keep_after
-        current_pos = run_end
+        return False
+    paragraph.runs[0].text = full_text.replace(old_text, new_text)
+    for run in paragraph.runs[1:]:
+        run.text = ''
+    return True
+
+# Build an Aho-Corasick automaton over the placeholder texts
+def build_automaton(replacements):
+    if not replacements:
+        return None
+    automaton = ahocorasick.Automaton()
+    for placeholder, value in replacements.items():
+        placeholder_text = f"{{{{{placeholder}}}}}"
+        automaton.add_word(placeholder_text, (placeholder, placeholder_text, value))
+    automaton.make_automaton()
+    return automaton
 
 # Replace placeholders in the document
-def replace_placeholders(doc, data, mapping):
-    for placeholder, (column, _) in mapping.items():
-        if column:
-            placeholder_text = f"{{{{{placeholder}}}}}"
-            value = str(data[column])
-            for paragraph in doc.paragraphs:
-                replace_text_in_paragraph(paragraph, placeholder_text, value)
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            replace_text_in_paragraph(paragraph, placeholder_text, value)
-            for section in doc.sections:
-                for header in section.header.paragraphs:
-                    replace_text_in_paragraph(header, placeholder_text, value)
-                for footer in section.footer.paragraphs:
-                    replace_text_in_paragraph(footer, placeholder_text, value)
-    unreplaced = set()
-    pattern = re.compile(r'\{\{(.+?)\}\}')
-    def check_unreplaced(runs):
-        full_text = ''.join(run.text for run in runs)
-        return pattern.findall(full_text)
-    for paragraph in doc.paragraphs:
-        unreplaced.update(check_unreplaced(paragraph.runs))
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    unreplaced.update(check_unreplaced(paragraph.runs))
-    for section in doc.sections:
-        for header in section.header.paragraphs:
-            unreplaced.update(check_unreplaced(header.runs))
-        for footer in section.footer.paragraphs:
-            unreplaced.update(check_unreplaced(footer.runs))
-    return doc, unreplaced
+def replace_placeholders(doc, replacements):
+    automaton = build_automaton(replacements)
+    replaced = set()
+    if automaton:
+        for paragraph in iter_all_paragraphs(doc):
+            full_text = ''.join(run.text for run in paragraph.runs)
+            if '{{' not in full_text:
+                continue
+            for _, (placeholder, placeholder_text, value) in automaton.iter(full_text):
+                if replace_text_in_paragraph(paragraph, placeholder_text, value):
+                    replaced.add(placeholder)
+    return doc, replaced
+
+# Reusable per-process buffer for docx serialization
+_SAVE_BUFFER = BytesIO()
+
+# Render a single row against the template (runs in a worker process)
+def _render_row(args):
+    template_bytes, replacements, data, mapping = args
+    temp_doc = Document(BytesIO(template_bytes))
+    temp_doc, replaced_placeholders = replace_placeholders(temp_doc, replacements)
+    unreplaced = set(mapping.keys()) - replaced_placeholders
+    used_columns = {mapping[p][0] for p in replaced_placeholders if mapping[p][0]}
+    invalid_braces = find_invalid_braces(temp_doc)
+    _SAVE_BUFFER.seek(0)
+    _SAVE_BUFFER.truncate()
+    temp_doc.save(_SAVE_BUFFER)
+    return _SAVE_BUFFER.getvalue(), replaced_placeholders, unreplaced, used_columns, invalid_braces, data
 
 # Generate documents for each row
 def generate_documents(df, template, mapping):
+    template.seek(0)
+    base_doc = Document(BytesIO(template.read()))
+    normalize_template_runs(base_doc)
+    buffer = BytesIO()
+    base_doc.save(buffer)
+    template_bytes = buffer.getvalue()
+    used_cols = sorted({column for column, _ in mapping.values() if column})
+    col_idx = {col: i for i, col in enumerate(used_cols)}
+    ph_to_idx = {
+        placeholder: col_idx[column]
+        for placeholder, (column, _) in mapping.items() if column
+    }
+    values = df[used_cols].astype(object).values
+    records = df.to_dict(orient='records')
+    tasks = [
+        (template_bytes,
+         {placeholder: str(values[i, j]) for placeholder, j in ph_to_idx.items()},
+         records[i],
+         mapping)
+        for i in range(len(records))
+    ]
+    with ProcessPoolExecutor() as executor:
+        results = list(executor.map(_render_row, tasks, chunksize=4))
     documents = []
-    for index, row in df.iterrows():
-        temp_doc = Document(template)
-        data = row.to_dict()
-        temp_doc, unreplaced = replace_placeholders(temp_doc, data, mapping)
-        replaced_placeholders = set(mapping.keys()) - unreplaced
-        used_columns = {mapping[p][0] for p in replaced_placeholders if mapping[p][0]}
+    for idx, (doc_bytes, replaced_placeholders, unreplaced, used_columns, invalid_braces, data) in enumerate(results):
         unused_columns = set(df.columns) - used_columns
-        invalid_braces = find_invalid_braces(temp_doc)
-        output = BytesIO()
-        temp_doc.save(output)
-        output.seek(0)
-        documents.append((output, replaced_placeholders, unreplaced, unused_columns, invalid_braces, row))
+        product_name = sanitize_filename(data.get('Product Name', 'unknown'))
+        product_code = sanitize_filename(data.get('Product Code', 'unknown'))
+        filename = f"{product_name}_{product_code}_row_{idx + 1}.docx"
+        documents.append((BytesIO(doc_bytes), replaced_placeholders, unreplaced, unused_columns, invalid_braces, data, filename))
     return documents
 
 # Main function
@@ -220,32 +241,31 @@ def main():
             with st.spinner("Making your documents, please wait..."):
                 documents = generate_documents(df, template_file, mapping)
             
-            # Create ZIP file with named documents
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-                for idx, (doc_data, _, _, _, _, row) in enumerate(documents):
-                    product_name = sanitize_filename(row.get('Product Name', 'unknown'))
-                    product_code = sanitize_filename(row.get('Product Code', 'unknown'))
-                    filename = f"{product_name}_{product_code}_row_{idx + 1}.docx"
-                    zip_file.writestr(filename, doc_data.getvalue())
+            # Create ZIP file with named documents; docx entries are already
+            # zip-compressed, so store them as-is and spill to disk if large
+            zip_buffer = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+            with zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_STORED) as zip_file:
+                for doc_data, _, _, _, _, _, filename in documents:
+                    zip_file.writestr(filename, doc_data.getbuffer())
             zip_buffer.seek(0)
-            
+            zip_bytes = zip_buffer.read()
+            zip_buffer.close()
+
             # Download all as ZIP
             st.success("All done! Download your files below!")
             st.info("Documents are named as 'product_name_product_code_row_X.docx' to ensure uniqueness.")
             st.download_button(
                 label="Download All Documents in a ZIP",
-                data=zip_buffer,
+                data=zip_bytes,
                 file_name="all_documents.zip",
                 mime="application/zip",
                 help="Click to get all your documents in one ZIP file!"
             )
             
             # Show concise reports
-            for idx, (doc_data, replaced, unreplaced, unused_columns, invalid_braces, row) in enumerate(documents):
+            for doc_data, replaced, unreplaced, unused_columns, invalid_braces, row, filename in documents:
                 product_name = row.get('Product Name', 'Not found')
                 product_code = row.get('Product Code', 'Not found')
-                filename = f"{sanitize_filename(product_name)}_{sanitize_filename(product_code)}_row_{idx + 1}.docx"
                 st.subheader(f"Report for {filename}")
                 
                 # Summary